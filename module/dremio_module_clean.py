@@ -3,7 +3,7 @@ import utils
 
 
 def get_resource_id(dremio_server, path, auth_headers):
-    response = utils.api_get(dremio_server, "catalog/by-path/" + path, auth_headers, "")
+    response = utils.api_get(dremio_server, "catalog/by-path/" + path, auth_headers)
     print(response)
     if 'id' in response:
         return response['id']
@@ -1,41 +1,60 @@
-import json
-from time import sleep
-import requests
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from time import monotonic, sleep
+from urllib.parse import quote
 from fybrik_python_logging import init_logger, logger
 import utils
 
 
+# Constant parts of the Dremio request payloads, the dynamic fields are merged in per call
+_ADMIN_USER_BODY = {
+    "firstName": "user",
+    "lastName": "admin",
+    "email": "test@test.com",
+}
+_ADMIN_USER_HEADERS = {'Content-Type': 'application/json', 'Authorization': '_dremionull'}
+_S3_SOURCE_TEMPLATE = {
+    "entityType": "source",
+    "type": "S3",
+    "config": {
+        "secure": "false",
+        "allowCreateDrop": "true",
+        "rootPath": "/",
+        "credentialType": "ACCESS_KEY",
+        "enableAsync": "true",
+        "compatibilityMode": "true",
+        "isCachingEnabled": "true",
+        "maxCacheSpacePct": 100,
+        "requesterPays": "false",
+        "enableFileStatusCheck": "true",
+    },
+}
+_VDS_TEMPLATE = {
+    "entityType": "dataset",
+    "type": "VIRTUAL_DATASET",
+}
+_NEW_USER_BODY = {
+    "name": "newUser",
+    "firstName": "first",
+    "password": "testpassword123",
+}
+
+
 def register_admin_user(dremio_server, admin_user, admin_password):
-    data_user = {
-        "userName": admin_user,
-        "firstName": "user",
-        "lastName": "admin",
-        "email": "test@test.com",
-        "password": admin_password,
-    }
-    headers = {'Content-Type': 'application/json', 'Authorization': '_dremionull'}
-    response = requests.request("PUT", dremio_server + '/apiv2/bootstrap/firstuser', data=json.dumps(data_user), headers=headers)
-    logger.debug("register user response: %s", response.text)
+    data_user = {**_ADMIN_USER_BODY, "userName": admin_user, "password": admin_password}
+    response = utils.get_session().put(dremio_server + '/apiv2/bootstrap/firstuser', data=utils.json_dumps(data_user), headers=_ADMIN_USER_HEADERS)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("register user response: %s", response.text)
 
 
 def create_s3_source(dremio_server, auth_headers, creds, endpoint, source_name):
     data_s3 = {
-        "entityType": "source",
+        **_S3_SOURCE_TEMPLATE,
         "name": source_name,
-        "type": "S3",
         "config": {
+            **_S3_SOURCE_TEMPLATE["config"],
             "accessKey": creds[0],
             "accessSecret": creds[1],
-            "secure": "false",
-            "allowCreateDrop": "true",
-            "rootPath": "/",
-            "credentialType": "ACCESS_KEY",
-            "enableAsync": "true",
-            "compatibilityMode": "true",
-            "isCachingEnabled": "true",
-            "maxCacheSpacePct": 100,
-            "requesterPays": "false",
-            "enableFileStatusCheck": "true",
             "propertyList": [
                 {"name": "fs.s3a.path.style.access", "value": "true"},
                 {"name": "fs.s3a.endpoint", "value": endpoint},
@@ -58,25 +77,38 @@ def promote_folder(dremio_server, auth_headers, path, source_name):
             "type": "Iceberg"
         }
     }
-    promote_url = source_name + '%2F' + '%2F'.join(path_list[1:])
-    response = utils.api_post(dremio_server, "catalog/dremio%3A%2F" + promote_url, auth_headers, dataPromote)
+    promote_url = quote("dremio:/" + '/'.join(path_list), safe='')
+    response = utils.api_post(dremio_server, "catalog/" + promote_url, auth_headers, dataPromote)
     logger.debug("promote response: %s", response)
     return path_list
 
 
-def get_table_columns(dremio_server, auth_headers, sql_path):
+def get_table_columns(dremio_server, auth_headers, sql_path, timeout=120):
     dataSQL = {
-        "sql": 'SELECT * FROM "' + sql_path + 'LIMIT 0'
+        "sql": f'SELECT * FROM {sql_path} LIMIT 0'
     }
     response = utils.api_post(dremio_server, "sql", auth_headers, dataSQL)
     job_id = response.get("id")
-    
-    response = utils.api_get(dremio_server, "job/"+job_id, auth_headers, dataSQL)
-    while(response.get("jobState") != "COMPLETED"):
-        logger.info("wait for job")
-        response = utils.api_get(dremio_server, "job/"+job_id, auth_headers, dataSQL)
-        sleep(10)
-    response = utils.api_get(dremio_server, "job/"+job_id+"/results", auth_headers, dataSQL)
+
+    # Ask for the results directly once, a schema-only job is often done by now.
+    # Otherwise poll the job state with exponential backoff and fetch the results when it completes
+    response = utils.api_get(dremio_server, "job/"+job_id+"/results", auth_headers)
+    if "schema" not in response:
+        delay = 0.1
+        deadline = monotonic() + timeout
+        job_state = utils.api_get(dremio_server, "job/"+job_id, auth_headers).get("jobState")
+        while job_state != "COMPLETED":
+            if job_state in ("FAILED", "CANCELED"):
+                raise RuntimeError("Dremio job " + job_id + " ended in state " + job_state)
+            if monotonic() >= deadline:
+                raise RuntimeError("Timed out waiting for Dremio job " + job_id)
+            logger.info("wait for job")
+            sleep(delay)
+            delay = min(delay * 2, 2.0)
+            job_state = utils.api_get(dremio_server, "job/"+job_id, auth_headers).get("jobState")
+        response = utils.api_get(dremio_server, "job/"+job_id+"/results", auth_headers)
+        if "schema" not in response:
+            raise RuntimeError("Dremio job " + job_id + " completed without a schema: " + str(response))
     col_names = [elem.get("name") for elem in response.get("schema")]
     logger.debug("Table's columns: %s", col_names)
     return col_names
@@ -87,37 +119,28 @@ def get_policy_query(transformation_cols, sql_path, col_names):
     if len(request_cols) < 1:
         logger.debug("empty dataset")
         return ""
-    requested_cols_string = request_cols[0]
-    for col in request_cols[1:]:
-        add_col = ", " + col
-        requested_cols_string += add_col
-    sql_vds = "select " + requested_cols_string + ' from "' + sql_path
+    requested_cols_string = ", ".join(request_cols)
+    sql_vds = "select " + requested_cols_string + ' from ' + sql_path
     logger.debug("SQL to build VDS: %s", sql_vds)
     return sql_vds
 
 
 def create_VDS(dremio_server, auth_headers, path_list, sql_vds, newVDSName):
     dataVDS = {
-        "entityType": "dataset",
+        **_VDS_TEMPLATE,
         "path": [
             "Space-api",
             newVDSName,
         ],
-	    "type": "VIRTUAL_DATASET",
-	    "sql": sql_vds,
-	    "sqlContext": path_list
+        "sql": sql_vds,
+        "sqlContext": path_list
     }
     response = utils.api_post(dremio_server, "catalog", auth_headers, dataVDS)
     logger.debug("Create VDS response: %s", response)
 
 
 def create_new_user(dremio_server, auth_headers):
-    dataNewUser = {
-        "name": "newUser",
-        "firstName": "first",
-        "password": "testpassword123",
-    }
-    response = utils.api_post(dremio_server, "user", auth_headers, dataNewUser)
+    response = utils.api_post(dremio_server, "user", auth_headers, _NEW_USER_BODY)
     logger.debug("Create new user response: %s", response)
 
 
@@ -134,7 +157,8 @@ if __name__ == "__main__":
     dremio_creds = conf['dremio_creds']
     username = dremio_creds[0]
     password = dremio_creds[1]
-    logger.debug("dremio username: " + username + " dremio password: " + password)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("dremio username: " + username + " dremio password: " + password)
 
     endpoint = conf['endpoint_url']
     path = conf['path']
@@ -147,36 +171,41 @@ if __name__ == "__main__":
     # Login to Dremio with admin user
     auth_headers = utils.login(dremio_server, username, password, json_headers)
 
-    # Create a new source from an s3 bucket
-    source_name = "sample-iceberg"
-    create_s3_source(dremio_server, auth_headers, asset_creds, endpoint, source_name)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # The space and the new user don't depend on the source, create them in the background
+        payloadSpace = {
+            "entityType": "space",
+            "name": "Space-api"
+        }
+        space_future = executor.submit(utils.api_post, dremio_server, "catalog", auth_headers, payloadSpace)
+        # Add a new user
+        user_future = executor.submit(create_new_user, dremio_server, auth_headers)
 
-    # Get data folder path
-    response = utils.api_get(dremio_server, endpoint="catalog/by-path/{name}/{path}".format(name=source_name, path=path), headers=auth_headers)
-    logger.debug("Get path of the data folder: %s", response)
+        # Create a new source from an s3 bucket
+        source_name = "sample-iceberg"
+        create_s3_source(dremio_server, auth_headers, asset_creds, endpoint, source_name)
 
-    # Promote a folder to dataset
-    path_list = promote_folder(dremio_server, auth_headers, path, source_name)
+        # Get data folder path
+        response = utils.api_get(dremio_server, endpoint=f"catalog/by-path/{source_name}/{path}", headers=auth_headers)
+        logger.debug("Get path of the data folder: %s", response)
 
-    # Get the columns of the new source
-    sql_path = source_name + '"."' + '"."'.join(path_list[1:]) + '"'
-    col_names = get_table_columns(dremio_server, auth_headers, sql_path)
+        # Promote a folder to dataset
+        path_list = promote_folder(dremio_server, auth_headers, path, source_name)
 
-    # Get the sql query from the policies
-    sql_vds = get_policy_query(transformation_cols, sql_path, col_names)
+        # Get the columns of the new source
+        sql_path = '"' + '"."'.join(path_list) + '"'
+        col_names = get_table_columns(dremio_server, auth_headers, sql_path)
 
-    payloadSpace = {
-        "entityType": "space",
-        "name": "Space-api"
-    }
-    response = utils.api_post(dremio_server, "catalog", auth_headers, payloadSpace)
-    logger.debug("Create space: %s", response)
-    
-    # Create a virtual dataset that represents the source dataset after applying the policies
-    newVDSName = "sample-iceberg-vds"
-    create_VDS(dremio_server, auth_headers, path_list, sql_vds, newVDSName)
-
-    # Add a new user
-    create_new_user(dremio_server, auth_headers)
+        # Get the sql query from the policies
+        sql_vds = get_policy_query(transformation_cols, sql_path, col_names)
+
+        response = space_future.result()
+        logger.debug("Create space: %s", response)
+
+        # Create a virtual dataset that represents the source dataset after applying the policies
+        newVDSName = "sample-iceberg-vds"
+        create_VDS(dremio_server, auth_headers, path_list, sql_vds, newVDSName)
+
+        user_future.result()
 
     logger.info("Finished configuring Dremio")
@@ -1,24 +1,91 @@
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import json
-import socket
+import logging
+import threading
 from time import sleep
 import yaml
 import requests
-from fybrik_python_vault import get_jwt_from_file, get_raw_secret_from_vault
+from fybrik_python_vault import get_jwt_from_file, vault_jwt_auth
 from fybrik_python_logging import init_logger, logger, DataSetID, ForUser
+from fybrik_python_tls import SSLContextAdapter, create_ssl_context
+try:
+    import orjson
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    json_dumps = json.dumps
+    json_loads = json.loads
  
 
 data_dict = {}
 
+# Vault client tokens keyed by (vault_address, vault_path, role, jwt), one login serves all secret reads
+vault_tokens = {}
+# Held across the lookup and the login so concurrent datasets wait for the first login
+vault_tokens_lock = threading.Lock()
+
+# One session per thread so sequential calls reuse keep-alive connections,
+# requests doesn't document Session as safe to share between threads
+_sessions = threading.local()
+
+# Prefer the libyaml-backed loader when PyYAML was built with it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@lru_cache(maxsize=4)
+def get_jwt(jwt_file_path):
+    """ Read the service account token once per path, it doesn't change during a run """
+    return get_jwt_from_file(jwt_file_path)
+
+
+def get_session():
+    """ Get the calling thread's requests session, creating it on first use """
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = requests.Session()
+        # Same TLS setup as fybrik_python_vault uses for the vault login
+        session.mount('https://', SSLContextAdapter(create_ssl_context()))
+        _sessions.session = session
+    return session
+
+
+def get_client_token(jwt, vault_address, vault_path, role, data_set_id):
+    """ Authenticate against vault once and reuse the client token for the following secret reads """
+    key = (vault_address, vault_path, role, jwt)
+    with vault_tokens_lock:
+        if key not in vault_tokens:
+            vault_auth_response = vault_jwt_auth(jwt, vault_address, vault_path, role, data_set_id)
+            if not vault_auth_response or "client_token" not in (vault_auth_response.get("auth") or {}):
+                logger.error("Malformed vault authorization response",
+                             extra={DataSetID: data_set_id, ForUser: True})
+                return None
+            vault_tokens[key] = vault_auth_response["auth"]["client_token"]
+        return vault_tokens[key]
+
+
+def fetch_secret(client_token, vault_address, secret_path, data_set_id):
+    """ Read a raw secret from vault using an existing client token """
+    secret_full_path = vault_address + secret_path
+    response = get_session().get(secret_full_path, headers={"X-Vault-Token": client_token})
+    logger.debug('Response received from vault when accessing credentials: ' + str(response.status_code),
+        extra={'credentials_path': str(secret_full_path),
+               DataSetID: data_set_id, ForUser: True})
+    if response.status_code == 200:
+        return json_loads(response.content).get('data')
+    return None
+
 
 def get_credentials_from_vault(vault_credentials, secret_path, data_set_id):
     """ Use the fybrik-python-library to get the access_key and secret_key from vault for s3 dataset """
     jwt_file_path = vault_credentials.get('jwt_file_path', '/var/run/secrets/kubernetes.io/serviceaccount/token')
-    jwt = get_jwt_from_file(jwt_file_path)
+    jwt = get_jwt(jwt_file_path)
     vault_address = vault_credentials.get('address', 'https://localhost:8200')
     vault_auth = vault_credentials.get('authPath', '/v1/auth/kubernetes/login')
     role = vault_credentials.get('role', 'demo')
-    credentials = get_raw_secret_from_vault(jwt, secret_path, vault_address, vault_auth, role, data_set_id)
+    client_token = get_client_token(jwt, vault_address, vault_auth, role, data_set_id)
+    credentials = fetch_secret(client_token, vault_address, secret_path, data_set_id) if client_token else None
     if not credentials:
         raise ValueError("Vault credentials are missing")
     if 'access_key' in credentials and 'secret_key' in credentials:
@@ -35,89 +102,102 @@ def get_credentials_from_vault(vault_credentials, secret_path, data_set_id):
     raise ValueError("Vault credentials are missing")
 
 
+def get_dataset_details(data, dremio_cred_ns):
+    """ Get the details of a single dataset from the configuration, including its credentials """
+    dataset_id = data["name"]
+    name = dataset_id.split("/")[1]
+    s3 = data["connection"]["s3"]
+    endpoint_url = s3["endpoint_url"]
+    vault_credentials = s3["vault_credentials"]
+    asset_creds = get_credentials_from_vault(vault_credentials, vault_credentials.get('secretPath', '/v1/secret/data/cred'), dataset_id)
+    secret_path = "/v1/kubernetes-secrets/dremio-cluster?namespace=" + dremio_cred_ns
+    dremio_creds = get_credentials_from_vault(vault_credentials, secret_path, dataset_id)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("creds: " + asset_creds[0] + "   " + asset_creds[1] + "   " + dremio_creds[0] + "   " + dremio_creds[1])
+    transformations_json = json_loads(base64.b64decode(data["transformations"]))
+    t0 = transformations_json[0]
+    transformation = t0['name']
+    transformation_cols = t0[transformation]["columns"]
+    return name, {'format': data["format"], 'endpoint_url': endpoint_url, 'path': data["path"], 'transformation': transformation,
+     'transformation_cols': transformation_cols, 'asset_creds': asset_creds, 'dremio_creds': dremio_creds}
+
+
 def get_details_from_conf():
     """ Parse the configuration and get the data details and policies """
-    with open("/etc/conf/conf.yaml", 'r') as stream:
-        content = yaml.safe_load(stream)
+    with open("/etc/conf/conf.yaml", 'rb') as stream:
+        content = yaml.load(stream, Loader=_YAML_LOADER)
         if "dremioHost" in content.keys():
             dremio_host = content["dremioHost"]
         if "dremioPort" in content.keys():
             dremio_port = content["dremioPort"]
         if "dremioCredNS" in content.keys():
             dremio_cred_ns = content["dremioCredNS"]
-        for key, val in content.items():
-            if "data" in key:
-                for data in val:
-                    dataset_id = data["name"]
-                    name = dataset_id.split("/")[1]
-                    endpoint_url = data["connection"]["s3"]["endpoint_url"]
-                    vault_credentials = data["connection"]["s3"]["vault_credentials"]
-                    asset_creds = get_credentials_from_vault(vault_credentials, vault_credentials.get('secretPath', '/v1/secret/data/cred'), dataset_id)
-                    secret_path = "/v1/kubernetes-secrets/dremio-cluster?namespace=" + dremio_cred_ns
-                    dremio_creds = get_credentials_from_vault(vault_credentials, secret_path, dataset_id)
-                    logger.debug("creds: " + asset_creds[0] + "   " + asset_creds[1] + "   " + dremio_creds[0] + "   " + dremio_creds[1])
-                    transformations = base64.b64decode(data["transformations"])
-                    transformations_json = json.loads(transformations.decode('utf-8'))
-                    transformation = transformations_json[0]['name']
-                    transformation_cols = transformations_json[0][transformation]["columns"]
-                    data_dict[name] = {'format': data["format"], 'endpoint_url': endpoint_url, 'path': data["path"], 'transformation': transformation,
-                     'transformation_cols': transformation_cols, 'asset_creds': asset_creds, 'dremio_creds': dremio_creds}
+        val = content.get("data")
+        if not val:
+            raise ValueError("No datasets found in the configuration")
+        # Vault lookups are independent per dataset, so fetch them concurrently
+        with ThreadPoolExecutor(max_workers=min(8, len(val))) as executor:
+            for name, details in executor.map(lambda data: get_dataset_details(data, dremio_cred_ns), val):
+                data_dict[name] = details
     return data_dict[name], dremio_host, dremio_port
 
 
 def api_get(server, endpoint=None, headers=None, body=None):
     """" Run GET command """
-    return json.loads(requests.get(url='{server}/api/v3/{endpoint}'.format(server=server, endpoint=endpoint), headers=headers, data=json.dumps(body)).text)
+    data = None if body is None else json_dumps(body)
+    return json_loads(get_session().get(url=f'{server}/api/v3/{endpoint}', headers=headers, data=data).content)
 
 
 def api_post(server, endpoint=None, headers=None, body=None):
     """" Run POST command """
-    text = requests.request("POST", '{server}/api/v3/{endpoint}'.format(server=server, endpoint=endpoint), headers=headers, data=json.dumps(body)).text
+    response = get_session().post(f'{server}/api/v3/{endpoint}', headers=headers, data=json_dumps(body))
 
     # a post may return no data
-    if (text):
-        return json.loads(text)
-    else:
-        return None
+    return json_loads(response.content) if response.content else None
 
 
 def api_delete(server, endpoint=None, headers=None):
     """" Run DELETE command """
-    return requests.delete('{server}/api/v3/{endpoint}'.format(server=server, endpoint=endpoint), headers=headers)
+    return get_session().delete(f'{server}/api/v3/{endpoint}', headers=headers)
 
 
 def login(server, username, password, headers=None):
     """" Login to Dremio using the given username and password """
     loginData = {'userName': username, 'password': password}
-    response = requests.post('{server}/apiv2/login'.format(server=server), headers=headers, data=json.dumps(loginData))
-    logger.debug("Login response: %s", response)
-    data = json.loads(response.text)
+    response = get_session().post(f'{server}/apiv2/login', headers=headers, data=json_dumps(loginData))
+    logger.debug("Login response status: %s", response.status_code)
 
     # retrieve the login token
-    token = data['token']
-    return {'Content-Type': 'application/json', 'Authorization': '_dremio{authToken}'.format(authToken=token)}
+    try:
+        token = json_loads(response.content)['token']
+    except (KeyError, TypeError, ValueError):
+        raise RuntimeError(f"Login failed: {response.status_code} {response.text[:200]}")
+    return {'Content-Type': 'application/json', 'Authorization': f'_dremio{token}'}
 
 
 def wait_dremio(dremio_host, dremio_port, timeout=600):
-    """ Try to connect to Dremio until success or timeout """
-    a_socket = socket.socket()
+    """ Poll Dremio's server status endpoint until it is ready or timeout """
+    status_url = f'http://{dremio_host}:{dremio_port}/apiv2/server_status'
+    delay = 0.25
     slept = 0
     while slept < timeout:
         logger.info("Wait dremio")
         try:
             logger.info("Trying to connect to dremio cluster at: %s:%s", dremio_host, dremio_port)
-            a_socket.connect((dremio_host, dremio_port))
-            return 0
-        except:
-            sleep(10)
-            slept += 10
+            if get_session().get(status_url, timeout=2).ok:
+                return 0
+        except requests.exceptions.RequestException:
+            pass
+        sleep(delay)
+        slept += delay
+        delay = min(delay * 2, 10)
     # We must have timed out
     return 1
 
 
 def wait_for_query(server, auth_headers, job_id, timeout=60):
     """ Wait for the query to finish """
-    result_endpoint = "job/{id}".format(id=job_id)
+    result_endpoint = f"job/{job_id}"
     slept = 0
     while slept < timeout:
         logger.info("Wait for query")